@@ -1,11 +1,30 @@
-﻿import numpy as np
+﻿import sys
+from datetime import datetime
+
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
+if not __package__:
+    # run as a script (python pipelines/<layer>/transform.py): make the repo root importable
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from pipelines.stage_metrics import track_stage, write_run_metrics  # noqa: E402
+
 
 SLA_HOURS = 72
 UNKNOWN = "desconocido"
 
+# Peru bounding box (same limits silver validates against) and grid levels.
+# Each zoom level splits the previous cell 10x10, so cells nest exactly.
+GRID_LAT_MIN, GRID_LAT_MAX = -19.5, -0.5
+GRID_LON_MIN, GRID_LON_MAX = -82.5, -68.0
+GRID_BASE_DEG = 1.0
+GRID_ZOOMS = [1, 2, 3]
+GRID_SPLIT = 10
+# cell indices are computed in integer micro-degrees so points on grid lines are not split by float error
+GRID_MICRODEG = 1_000_000
+
 
 def load_silver(base: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
     solicitudes = pd.read_parquet(base / "data" / "silver" / "solicitudes_ciudadanas.parquet")
@@ -101,20 +120,180 @@ def aggregate_metrics(df: pd.DataFrame, group_cols: list[str], is_lifetime: int)
     return agg
 
 
+def grid_cell_size(zoom: int) -> float:
+    return GRID_BASE_DEG / GRID_SPLIT ** (zoom - 1)
+
+
+def grid_cell_offset(values, origin: float, zoom: int) -> np.ndarray:
+    # unclamped cell index; shared by storage and bbox lookup so both agree on the cell of a coordinate
+    cell = round(grid_cell_size(zoom) * GRID_MICRODEG)
+    offset = np.round((np.asarray(values, dtype="float64") - origin) * GRID_MICRODEG).astype("int64")
+    return offset // cell
+
+
+def grid_cell_count(origin: float, extent: float, zoom: int) -> int:
+    cell = round(grid_cell_size(zoom) * GRID_MICRODEG)
+    return -(-round((extent - origin) * GRID_MICRODEG) // cell)
+
+
+def grid_index(values, origin: float, extent: float, zoom: int) -> np.ndarray:
+    # storage side: points on the max edge of the box (inclusive in silver) belong to the last cell
+    last = grid_cell_count(origin, extent, zoom) - 1
+    return np.clip(grid_cell_offset(values, origin, zoom), 0, last).astype("int32")
+
+
+def assign_grid_cells(df: pd.DataFrame) -> pd.DataFrame:
+    # one row per (request, zoom); requests without coordinates are skipped
+    lat = pd.to_numeric(df["latitude"], errors="coerce")
+    lon = pd.to_numeric(df["longitude"], errors="coerce")
+    located = lat.between(GRID_LAT_MIN, GRID_LAT_MAX) & lon.between(GRID_LON_MIN, GRID_LON_MAX)
+    df = df.loc[located]
+    lat = lat[located]
+    lon = lon[located]
+
+    levels = []
+    for zoom in GRID_ZOOMS:
+        levels.append(
+            df.assign(
+                zoom=np.int8(zoom),
+                cell_row=grid_index(lat, GRID_LAT_MIN, GRID_LAT_MAX, zoom),
+                cell_col=grid_index(lon, GRID_LON_MIN, GRID_LON_MAX, zoom),
+            )
+        )
+    return pd.concat(levels, ignore_index=True)
+
+
+def aggregate_grid(df: pd.DataFrame) -> pd.DataFrame:
+    cells = assign_grid_cells(df)
+    cells["sla_breach"] = (cells["resolution_hours"] > SLA_HOURS).astype(int)
+    cells["year"] = cells["year"].fillna(0).astype(int)
+    cells["month"] = cells["month"].fillna(0).astype(int)
+
+    cell_cols = ["zoom", "cell_row", "cell_col"]
+    metrics = dict(
+        total_requests=("request_id", "count"),
+        sla_breach_count=("sla_breach", "sum"),
+        avg_resolution_hours=("resolution_hours", "mean"),
+    )
+
+    monthly = cells[cells["year"] > 0].groupby(cell_cols + ["year", "month", "category"]).agg(**metrics).reset_index()
+    monthly["is_lifetime"] = 0
+    lifetime = cells.groupby(cell_cols + ["category"]).agg(**metrics).reset_index()
+    lifetime["year"] = 0
+    lifetime["month"] = 0
+    lifetime["is_lifetime"] = 1
+
+    grid = pd.concat([monthly, lifetime], ignore_index=True)
+    size = grid["zoom"].map(grid_cell_size)
+    grid["cell_id"] = (
+        grid["zoom"].astype(str) + "-" + grid["cell_row"].astype(str) + "-" + grid["cell_col"].astype(str)
+    )
+    grid["cell_lat"] = GRID_LAT_MIN + (grid["cell_row"] + 0.5) * size
+    grid["cell_lon"] = GRID_LON_MIN + (grid["cell_col"] + 0.5) * size
+    grid["sla_breach_rate"] = np.where(grid["total_requests"] > 0, grid["sla_breach_count"] / grid["total_requests"], np.nan)
+
+    # cell-sorted so a bbox lookup reads contiguous rows / parquet row groups
+    grid = grid.sort_values(cell_cols + ["is_lifetime", "year", "month", "category"]).reset_index(drop=True)
+    grid = grid.astype({"zoom": "int8", "cell_row": "int32", "cell_col": "int32", "year": "int16", "month": "int8", "is_lifetime": "int8"})
+    return grid[
+        [
+            "zoom",
+            "cell_id",
+            "cell_row",
+            "cell_col",
+            "cell_lat",
+            "cell_lon",
+            "is_lifetime",
+            "year",
+            "month",
+            "category",
+            "total_requests",
+            "sla_breach_count",
+            "sla_breach_rate",
+            "avg_resolution_hours",
+        ]
+    ]
+
+
+def bbox_cell_range(
+    zoom: int, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+) -> tuple[int, int, int, int] | None:
+    # None when the box is inverted or does not overlap the grid; clamping only happens after that
+    if min_lat > max_lat or min_lon > max_lon:
+        return None
+    if max_lat < GRID_LAT_MIN or min_lat > GRID_LAT_MAX or max_lon < GRID_LON_MIN or min_lon > GRID_LON_MAX:
+        return None
+
+    # the box now overlaps the grid, so clipping its corners to the grid is safe; corners on the
+    # max edge then map to the last cell, the same cell grid_index stores edge points in
+    rows = grid_index([max(min_lat, GRID_LAT_MIN), min(max_lat, GRID_LAT_MAX)], GRID_LAT_MIN, GRID_LAT_MAX, zoom)
+    cols = grid_index([max(min_lon, GRID_LON_MIN), min(max_lon, GRID_LON_MAX)], GRID_LON_MIN, GRID_LON_MAX, zoom)
+    return int(rows[0]), int(rows[1]), int(cols[0]), int(cols[1])
+
+
+def cells_in_bbox(
+    grid: pd.DataFrame | str | Path,
+    zoom: int,
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+) -> pd.DataFrame:
+    # accepts the loaded grid or the parquet path (filters are pushed down to the reader)
+    cell_range = bbox_cell_range(zoom, min_lat, min_lon, max_lat, max_lon)
+    if cell_range is None:
+        # keep the grid schema on empty results; no stored cell has a negative row
+        if isinstance(grid, (str, Path)):
+            return pd.read_parquet(grid, filters=[("cell_row", "<", 0)])
+        return grid.iloc[0:0]
+
+    row_min, row_max, col_min, col_max = cell_range
+    if isinstance(grid, (str, Path)):
+        return pd.read_parquet(
+            grid,
+            filters=[
+                ("zoom", "==", zoom),
+                ("cell_row", ">=", row_min),
+                ("cell_row", "<=", row_max),
+                ("cell_col", ">=", col_min),
+                ("cell_col", "<=", col_max),
+            ],
+        )
+    mask = (
+        (grid["zoom"] == zoom)
+        & grid["cell_row"].between(row_min, row_max)
+        & grid["cell_col"].between(col_min, col_max)
+    )
+    return grid.loc[mask]
+
+
 def main() -> None:
     base = Path(__file__).resolve().parents[2]
+    out_path = base / "data" / "gold" / "dashboard_reclamos.parquet"
+    grid_path = base / "data" / "gold" / "dashboard_grid.parquet"
+
+    started_at = datetime.now()
+    stages = []
 
-    solicitudes, oficinas = load_silver(base)
+    with track_stage(stages, "load_silver") as stage:
+        solicitudes, oficinas = load_silver(base)
+        stage["rows_out"] = int(len(solicitudes) + len(oficinas))
 
     # join and normalize
-    df = solicitudes.merge(oficinas, on="office_id", how="left", suffixes=("", "_office"))
-    df = normalize_gold(df)
+    with track_stage(stages, "merge_oficinas", rows_in=len(solicitudes)) as stage:
+        df = solicitudes.merge(oficinas, on="office_id", how="left", suffixes=("", "_office"))
+        stage["rows_out"] = int(len(df))
 
-    # calendar for monthly grain
-    df = add_calendar(df)
+    with track_stage(stages, "normalize_gold", rows_in=len(df)) as stage:
+        df = normalize_gold(df)
+        stage["rows_out"] = int(len(df))
 
-    # drop records without created_at for monthly aggregation
-    monthly = df[df["year"].notna()].copy()
+    # calendar for monthly grain
+    with track_stage(stages, "add_calendar", rows_in=len(df)) as stage:
+        df = add_calendar(df)
+        # drop records without created_at for monthly aggregation
+        monthly = df[df["year"].notna()].copy()
+        stage["rows_out"] = int(len(monthly))
 
     group_cols = [
         "year",
@@ -133,7 +312,9 @@ def main() -> None:
         "categoria_principal",
     ]
 
-    monthly_agg = aggregate_metrics(monthly, group_cols, is_lifetime=0)
+    with track_stage(stages, "aggregate_monthly", rows_in=len(monthly)) as stage:
+        monthly_agg = aggregate_metrics(monthly, group_cols, is_lifetime=0)
+        stage["rows_out"] = int(len(monthly_agg))
 
     lifetime_group_cols = [
         "category",
@@ -149,16 +330,30 @@ def main() -> None:
         "categoria_principal",
     ]
 
-    lifetime_agg = aggregate_metrics(df, lifetime_group_cols, is_lifetime=1)
+    with track_stage(stages, "aggregate_lifetime", rows_in=len(df)) as stage:
+        lifetime_agg = aggregate_metrics(df, lifetime_group_cols, is_lifetime=1)
+        stage["rows_out"] = int(len(lifetime_agg))
 
-    gold = pd.concat([monthly_agg, lifetime_agg], ignore_index=True)
+    with track_stage(stages, "write_parquet", rows_in=len(monthly_agg) + len(lifetime_agg)) as stage:
+        gold = pd.concat([monthly_agg, lifetime_agg], ignore_index=True)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        gold.to_parquet(out_path, index=False)
+        stage["rows_out"] = int(len(gold))
 
-    out_path = base / "data" / "gold" / "dashboard_reclamos.parquet"
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    gold.to_parquet(out_path, index=False)
+    with track_stage(stages, "aggregate_grid", rows_in=len(df)) as stage:
+        grid = aggregate_grid(df)
+        stage["rows_out"] = int(len(grid))
+
+    with track_stage(stages, "write_grid_parquet", rows_in=len(grid)) as stage:
+        grid.to_parquet(grid_path, index=False)
+        stage["rows_out"] = int(len(grid))
+
+    metrics_path = write_run_metrics("gold", started_at, stages, out_path.parent)
 
     print("Gold generado:")
     print("-", out_path)
+    print("-", grid_path)
+    print("-", metrics_path)
 
 
 if __name__ == "__main__":
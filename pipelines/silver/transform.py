@@ -1,10 +1,18 @@
 ﻿import json
 import re
+import sys
+from datetime import datetime
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+if not __package__:
+    # run as a script (python pipelines/<layer>/transform.py): make the repo root importable
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from pipelines.stage_metrics import track_stage, write_run_metrics  # noqa: E402
+
 NULL_LIKE = {"", "NULL", "null", "NaN", "nan", "None", "none"}
 EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 REQUEST_ID_RE = re.compile(r"^REQ-\d{4}$")
@@ -253,20 +261,7 @@ def clean_solicitudes(df: pd.DataFrame, oficinas_ids: set[str], dedup: bool = Tr
     return df
 
 
-def main() -> None:
-    base = Path(__file__).resolve().parents[2]
-    bronze = base / "data" / "bronze"
-    silver = base / "data" / "silver"
-    silver.mkdir(parents=True, exist_ok=True)
-
-    solicitudes_raw = read_csv_bronze(bronze / "solicitudes_ciudadanas.csv")
-    oficinas_raw = read_csv_bronze(bronze / "oficinas.csv")
-
-    oficinas = clean_oficinas(oficinas_raw.copy())
-    oficinas_categorias = set(oficinas["categoria_principal"].dropna().astype(str).str.lower())
-    solicitudes = clean_solicitudes(solicitudes_raw.copy(), set(oficinas["office_id"].dropna()), dedup=False)
-
-    # Validation rules and quality log
+def validate_solicitudes(solicitudes: pd.DataFrame, oficinas_categorias: set[str]) -> tuple[pd.Series, dict]:
     total_records = int(len(solicitudes))
     errors = {}
 
@@ -340,16 +335,55 @@ def main() -> None:
         "errors_by_rule": errors,
     }
 
+    return invalid_mask, quality_log
+
+
+def main() -> None:
+    base = Path(__file__).resolve().parents[2]
+    bronze = base / "data" / "bronze"
+    silver = base / "data" / "silver"
+    silver.mkdir(parents=True, exist_ok=True)
+
+    started_at = datetime.now()
+    stages = []
+
+    with track_stage(stages, "read_csv_bronze") as stage:
+        solicitudes_raw = read_csv_bronze(bronze / "solicitudes_ciudadanas.csv")
+        oficinas_raw = read_csv_bronze(bronze / "oficinas.csv")
+        stage["rows_out"] = int(len(solicitudes_raw) + len(oficinas_raw))
+
+    with track_stage(stages, "clean_oficinas", rows_in=len(oficinas_raw)) as stage:
+        oficinas = clean_oficinas(oficinas_raw.copy())
+        oficinas_categorias = set(oficinas["categoria_principal"].dropna().astype(str).str.lower())
+        stage["rows_out"] = int(len(oficinas))
+
+    with track_stage(stages, "clean_solicitudes", rows_in=len(solicitudes_raw)) as stage:
+        solicitudes = clean_solicitudes(solicitudes_raw.copy(), set(oficinas["office_id"].dropna()), dedup=False)
+        stage["rows_out"] = int(len(solicitudes))
+
+    # Validation rules and quality log
+    with track_stage(stages, "validate_solicitudes", rows_in=len(solicitudes)) as stage:
+        invalid_mask, quality_log = validate_solicitudes(solicitudes, oficinas_categorias)
+        stage["rows_out"] = quality_log["valid_records"]
+
     # Apply validity filter and dedup
-    solicitudes = solicitudes.loc[~invalid_mask].copy()
-    solicitudes = clean_solicitudes(solicitudes, set(oficinas["office_id"].dropna()), dedup=True)
+    with track_stage(stages, "dedup_solicitudes", rows_in=quality_log["valid_records"]) as stage:
+        solicitudes = solicitudes.loc[~invalid_mask].copy()
+        solicitudes = clean_solicitudes(solicitudes, set(oficinas["office_id"].dropna()), dedup=True)
+        stage["rows_out"] = int(len(solicitudes))
+
+    with track_stage(stages, "write_parquet", rows_in=len(solicitudes) + len(oficinas)) as stage:
+        solicitudes.to_parquet(silver / "solicitudes_ciudadanas.parquet", index=False)
+        oficinas.to_parquet(silver / "oficinas.parquet", index=False)
+        stage["rows_out"] = int(len(solicitudes) + len(oficinas))
 
-    solicitudes.to_parquet(silver / "solicitudes_ciudadanas.parquet", index=False)
-    oficinas.to_parquet(silver / "oficinas.parquet", index=False)
+    with track_stage(stages, "quality_report", rows_in=len(solicitudes_raw)) as stage:
+        report = build_quality_report(solicitudes_raw, oficinas_raw, solicitudes, oficinas)
+        write_quality_report(report, silver)
+        (silver / "quality_log.json").write_text(json.dumps(quality_log, indent=2), encoding="utf-8")
+        stage["rows_out"] = int(len(solicitudes))
 
-    report = build_quality_report(solicitudes_raw, oficinas_raw, solicitudes, oficinas)
-    write_quality_report(report, silver)
-    (silver / "quality_log.json").write_text(json.dumps(quality_log, indent=2), encoding="utf-8")
+    metrics_path = write_run_metrics("silver", started_at, stages, silver)
 
     print("Silver generado:")
     print("-", silver / "solicitudes_ciudadanas.parquet")
@@ -357,6 +391,7 @@ def main() -> None:
     print("-", silver / "quality_report.json")
     print("-", silver / "quality_report.md")
     print("-", silver / "quality_log.json")
+    print("-", metrics_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_ENV = "PIPELINE_PROFILE"
+PROFILE_TOP_N = 15
+RUN_METRICS_FILE = "run_metrics.json"
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def peak_rss_mb() -> float | None:
+    # process-wide high-water mark, so it only grows from one stage to the next
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KiB, macOS reports bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 2)
+
+
+def top_profile_entries(profiler: cProfile.Profile, limit: int = PROFILE_TOP_N) -> list[dict]:
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{Path(filename).name}:{line}({func})",
+            "calls": int(ncalls),
+            "tottime_s": round(tottime, 4),
+            "cumtime_s": round(cumtime, 4),
+        }
+        for (filename, line, func), (_, ncalls, tottime, cumtime, _) in rows
+    ]
+
+
+@contextmanager
+def track_stage(stages: list[dict], name: str, rows_in: int | None = None):
+    stage = {"stage": name, "rows_in": rows_in, "rows_out": None}
+    profile = profiling_enabled()
+    profiler = cProfile.Profile() if profile else None
+    started_tracing = False
+    if profile:
+        # reuse tracing started elsewhere (PYTHONTRACEMALLOC, an outer profiler) and leave it running
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+            started_tracing = True
+        profiler.enable()
+    rss_before = peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield stage
+    finally:
+        stage["wall_time_s"] = round(time.perf_counter() - wall_start, 4)
+        stage["cpu_time_s"] = round(time.process_time() - cpu_start, 4)
+        if profile:
+            profiler.disable()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            stage["tracemalloc_peak_mb"] = round(traced_peak / (1024 * 1024), 2)
+            stage["profile_top"] = top_profile_entries(profiler)
+        rss_after = peak_rss_mb()
+        stage["peak_rss_mb"] = rss_after
+        # how far this stage pushed the process high-water mark (0 if it stayed below earlier peaks)
+        stage["peak_rss_delta_mb"] = round(rss_after - rss_before, 2) if rss_after is not None else None
+        stages.append(stage)
+
+
+def write_run_metrics(layer: str, started_at: datetime, stages: list[dict], out_dir: Path) -> Path:
+    # keep previous runs so the file doubles as a performance history
+    path = out_dir / RUN_METRICS_FILE
+    history = None
+    if path.exists():
+        try:
+            history = json.loads(path.read_text(encoding="utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            history = None
+    # an unreadable or hand-edited history must never fail an otherwise successful run
+    if not (isinstance(history, dict) and isinstance(history.get("runs"), list)):
+        history = {"runs": []}
+
+    history["runs"].append(
+        {
+            "layer": layer,
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "profiling": profiling_enabled(),
+            "total_wall_time_s": round(sum(s["wall_time_s"] for s in stages), 4),
+            "total_cpu_time_s": round(sum(s["cpu_time_s"] for s in stages), 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": stages,
+        }
+    )
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(history, indent=2), encoding="utf-8")
+    return path